@@ -0,0 +1,90 @@
+#   Copyright (c) 2024 PaddleHelix Authors. All Rights Reserved.
+#
+# Licensed under Creative Commons Attribution-NonCommercial-ShareAlike 4.0
+# International License (the "License");  you may not use this file  except
+# in compliance with the License. You may obtain a copy of the License at
+#
+#     http://creativecommons.org/licenses/by-nc-sa/4.0/
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# cython: language_level=3
+
+"""Compiled kernel for templates_quat_affine.make_canonical_transform.
+
+Built ahead of time with `python setup.py build_ext --inplace`; see setup.py
+for the compiler flags.
+"""
+
+cimport cython
+from cython cimport floating
+from cython.parallel cimport prange
+from libc.math cimport sqrt
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def make_canonical_kernel(floating[:, ::1] n,
+                          floating[:, ::1] ca,
+                          floating[:, ::1] c,
+                          floating[:, ::1] out_trans,
+                          floating[:, :, ::1] out_rot):
+    """Fused make_canonical_transform over flattened (M, 3) coordinates."""
+    cdef Py_ssize_t i
+    cdef floating t_x, t_y, t_z, n_x, n_y, n_z, c_x, c_y, c_z
+    cdef floating xy2, inv_norm, sin_c1, cos_c1, sin_c2, cos_c2, sin_n, cos_n
+    cdef floating r10, r11, r20, r21, r22, rn_y, rn_z
+
+    with nogil:
+        for i in prange(n.shape[0]):
+            # Place CA at the origin.
+            t_x = -ca[i, 0]
+            t_y = -ca[i, 1]
+            t_z = -ca[i, 2]
+            n_x = n[i, 0] + t_x
+            n_y = n[i, 1] + t_y
+            n_z = n[i, 2] + t_z
+            c_x = c[i, 0] + t_x
+            c_y = c[i, 1] + t_y
+            c_z = c[i, 2] + t_z
+
+            # Place C on the x-axis.
+            xy2 = c_x * c_x + c_y * c_y
+            inv_norm = 1 / sqrt(xy2 + 1e-20)
+            sin_c1 = -c_y * inv_norm
+            cos_c1 = c_x * inv_norm
+            inv_norm = 1 / sqrt(xy2 + c_z * c_z + 1e-20)
+            sin_c2 = c_z * inv_norm
+            cos_c2 = sqrt(xy2) * inv_norm
+
+            # c_rot = c2_rot @ c1_rot; its (1, 2) entry is zero.
+            r10 = sin_c1
+            r11 = cos_c1
+            r20 = -sin_c2 * cos_c1
+            r21 = sin_c2 * sin_c1
+            r22 = cos_c2
+
+            # Place N in the x-y plane.
+            rn_y = r10 * n_x + r11 * n_y
+            rn_z = r20 * n_x + r21 * n_y + r22 * n_z
+            inv_norm = 1 / sqrt(rn_y * rn_y + rn_z * rn_z + 1e-20)
+            sin_n = -rn_z * inv_norm
+            cos_n = rn_y * inv_norm
+
+            # rotation = n_rot @ c_rot.
+            out_trans[i, 0] = t_x
+            out_trans[i, 1] = t_y
+            out_trans[i, 2] = t_z
+            out_rot[i, 0, 0] = cos_c2 * cos_c1
+            out_rot[i, 0, 1] = -cos_c2 * sin_c1
+            out_rot[i, 0, 2] = sin_c2
+            out_rot[i, 1, 0] = cos_n * r10 - sin_n * r20
+            out_rot[i, 1, 1] = cos_n * r11 - sin_n * r21
+            out_rot[i, 1, 2] = -sin_n * r22
+            out_rot[i, 2, 0] = sin_n * r10 + cos_n * r20
+            out_rot[i, 2, 1] = sin_n * r11 + cos_n * r21
+            out_rot[i, 2, 2] = cos_n * r22
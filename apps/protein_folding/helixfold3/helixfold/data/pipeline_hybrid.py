@@ -179,9 +179,6 @@ def make_pseudo_beta(protein, prefix=''):
 
 def make_template_further_feature(protein):
 
-  def _np_unstack(a, axis=0):
-      return np.moveaxis(a, axis, 0)
-
   dtype = np.float32
 
   n, ca, c = [residue_constants.atom_order[a]
@@ -195,11 +192,13 @@ def make_template_further_feature(protein):
       translation=trans,
       rotation=rot)
 
-  points = [np.expand_dims(x, axis=-2) for x in
-            _np_unstack(affines.translation, axis=-1)]
+  points = np.expand_dims(affines.translation, axis=-3)
   affine_vec = affines.invert_point(points, extra_dims=1)
+  # Reducing over the length-3 trailing axis with np.sum is slow; spell the
+  # squared norm out per component instead.
+  vec_x, vec_y, vec_z = [affine_vec[..., i] for i in range(3)]
   inv_distance_scalar = 1.0 / np.sqrt(
-      1e-6 + sum([np.square(x) for x in affine_vec]))
+      1e-6 + (vec_x * vec_x + vec_y * vec_y + vec_z * vec_z))
 
   # NOTE: Backbone affine mask: whether the residue has C, CA, N
   # (the template mask defined above only considers pseudo CB).
@@ -212,9 +211,8 @@ def make_template_further_feature(protein):
   template_mask_2d = template_mask[..., None] * template_mask[..., None, :]
   inv_distance_scalar *= template_mask_2d
 
-  unit_vector = [(x * inv_distance_scalar)[..., None] for x in affine_vec]
-  unit_vector = [x.astype(dtype) for x in unit_vector]
-  unit_vector = np.concatenate(unit_vector, axis=-1)
+  unit_vector = affine_vec * inv_distance_scalar[..., None]
+  unit_vector = unit_vector.astype(dtype, copy=False)
   protein['template_unit_vector'] = unit_vector
 
   return protein
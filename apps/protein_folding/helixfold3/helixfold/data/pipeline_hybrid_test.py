@@ -0,0 +1,74 @@
+#   Copyright (c) 2024 PaddleHelix Authors. All Rights Reserved.
+#
+# Licensed under Creative Commons Attribution-NonCommercial-ShareAlike 4.0
+# International License (the "License");  you may not use this file  except
+# in compliance with the License. You may obtain a copy of the License at
+#
+#     http://creativecommons.org/licenses/by-nc-sa/4.0/
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for pipeline_hybrid."""
+
+from absl.testing import absltest
+from helixfold.common import residue_constants
+from helixfold.data import pipeline_hybrid
+from helixfold.data import templates_quat_affine
+import numpy as np
+
+
+def _reference_unit_vector(positions, masks):
+  """make_template_further_feature unit vectors, one component at a time."""
+  n, ca, c = [residue_constants.atom_order[a] for a in ('N', 'CA', 'C')]
+  rot, trans = templates_quat_affine.make_transform_from_reference(
+      positions[..., n, :], positions[..., ca, :], positions[..., c, :])
+  # Frame i against the translation of residue j: R_i^T (t_j - t_i).
+  diff = [trans[..., None, :, k] - trans[..., :, None, k] for k in range(3)]
+  vec = [sum(rot[..., :, None, k, i] * diff[k] for k in range(3))
+         for i in range(3)]
+  inv_distance = 1.0 / np.sqrt(1e-6 + sum(x * x for x in vec))
+  mask = masks[..., n] * masks[..., ca] * masks[..., c]
+  inv_distance *= mask[..., None] * mask[..., None, :]
+  return np.stack([x * inv_distance for x in vec], axis=-1), mask
+
+
+class PipelineHybridTest(absltest.TestCase):
+  """tbd."""
+
+  def testMakeTemplateFurtherFeature(self):
+    """tbd."""
+    rng = np.random.RandomState(0)
+    num_templates, num_res = 3, 12
+    positions = 5. * rng.normal(
+        size=(num_templates, num_res, residue_constants.atom_type_num, 3))
+    masks = np.ones((num_templates, num_res, residue_constants.atom_type_num))
+    # Residues with missing backbone atoms have all-zero coordinates.
+    positions[0, 3] = 0.
+    masks[0, 3] = 0.
+    positions[2, 7:] = 0.
+    masks[2, 7:] = 0.
+    positions = positions.astype(np.float32)
+    masks = masks.astype(np.float32)
+
+    protein = pipeline_hybrid.make_template_further_feature({
+        'template_all_atom_positions': positions,
+        'template_all_atom_masks': masks,
+    })
+    expected_unit_vector, expected_mask = _reference_unit_vector(
+        positions, masks)
+
+    unit_vector = protein['template_unit_vector']
+    self.assertEqual(unit_vector.shape, (num_templates, num_res, num_res, 3))
+    self.assertEqual(unit_vector.dtype, np.float32)
+    self.assertTrue(np.all(np.isfinite(unit_vector)))
+    np.testing.assert_allclose(unit_vector, expected_unit_vector, atol=1e-5)
+    np.testing.assert_array_equal(
+        protein['template_backbone_frame_mask'], expected_mask)
+
+
+if __name__ == '__main__':
+  absltest.main()
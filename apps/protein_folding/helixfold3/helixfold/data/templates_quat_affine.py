@@ -32,54 +32,38 @@ actually used are executed.
 """
 
 
+import functools
+import os
 import numpy as np
 from typing import Tuple
 
+try:
+    import numba
+    USE_NUMBA = True
+except ImportError:
+    USE_NUMBA = False
 
-QUAT_TO_ROT = np.zeros((4, 4, 3, 3), dtype=np.float32)
+# Compiled make_canonical_transform kernel, built ahead of time with
+# `python setup.py build_ext --inplace`.
+try:
+    from helixfold.data import _canonical_transform
+except ImportError:
+    _canonical_transform = None
 
-QUAT_TO_ROT[0, 0] = [[ 1, 0, 0], [ 0, 1, 0], [ 0, 0, 1]]  # rr
-QUAT_TO_ROT[1, 1] = [[ 1, 0, 0], [ 0,-1, 0], [ 0, 0,-1]]  # ii
-QUAT_TO_ROT[2, 2] = [[-1, 0, 0], [ 0, 1, 0], [ 0, 0,-1]]  # jj
-QUAT_TO_ROT[3, 3] = [[-1, 0, 0], [ 0,-1, 0], [ 0, 0, 1]]  # kk
-
-QUAT_TO_ROT[1, 2] = [[ 0, 2, 0], [ 2, 0, 0], [ 0, 0, 0]]  # ij
-QUAT_TO_ROT[1, 3] = [[ 0, 0, 2], [ 0, 0, 0], [ 2, 0, 0]]  # ik
-QUAT_TO_ROT[2, 3] = [[ 0, 0, 0], [ 0, 0, 2], [ 0, 2, 0]]  # jk
-
-QUAT_TO_ROT[0, 1] = [[ 0, 0, 0], [ 0, 0,-2], [ 0, 2, 0]]  # ir
-QUAT_TO_ROT[0, 2] = [[ 0, 0, 2], [ 0, 0, 0], [-2, 0, 0]]  # jr
-QUAT_TO_ROT[0, 3] = [[ 0,-2, 0], [ 2, 0, 0], [ 0, 0, 0]]  # kr
-
-QUAT_MULTIPLY = np.zeros((4, 4, 4), dtype=np.float32)
-QUAT_MULTIPLY[:, :, 0] = [[ 1, 0, 0, 0],
-                          [ 0,-1, 0, 0],
-                          [ 0, 0,-1, 0],
-                          [ 0, 0, 0,-1]]
-
-QUAT_MULTIPLY[:, :, 1] = [[ 0, 1, 0, 0],
-                          [ 1, 0, 0, 0],
-                          [ 0, 0, 0, 1],
-                          [ 0, 0,-1, 0]]
-
-QUAT_MULTIPLY[:, :, 2] = [[ 0, 0, 1, 0],
-                          [ 0, 0, 0,-1],
-                          [ 1, 0, 0, 0],
-                          [ 0, 1, 0, 0]]
-
-QUAT_MULTIPLY[:, :, 3] = [[ 0, 0, 0, 1],
-                          [ 0, 0, 1, 0],
-                          [ 0,-1, 0, 0],
-                          [ 1, 0, 0, 0]]
-
-QUAT_MULTIPLY_BY_VEC = QUAT_MULTIPLY[:, 1:, :]
+# Set HELIXFOLD_QUAT_BACKEND=jax to run jax.Array inputs through jitted kernels
+# in QuatAffine.rotation, apply_to_point, invert_point and pre_compose.
+USE_JAX = os.environ.get('HELIXFOLD_QUAT_BACKEND') == 'jax'
+if USE_JAX:
+    import jax
+    import jax.numpy as jnp
 
 
 def rot_to_quat(rot):
     """Convert rotation matrix to quaternion.
 
-    Note that this function calls self_adjoint_eig which is extremely expensive on
-    the GPU. If at all possible, this function should run on the CPU.
+    Uses Shepperd's method: for each rotation the largest of the four
+    diagonal terms 4*w^2, 4*x^2, 4*y^2, 4*z^2 is picked, so that only one
+    square root is needed and the divisions stay well-conditioned.
 
     Args:
         rot: rotation matrix (see below for format). rotation matrix should be shape (..., 3, 3)
@@ -87,81 +71,120 @@ def rot_to_quat(rot):
     Returns:
         Quaternion as (..., 4) tensor.
     """
-    rot = [ [rot[..., i, j] for j in range(3)] for i in range(3)]
-    [[xx, xy, xz], [yx, yy, yz], [zx, zy, zz]] = rot
-
-    # pylint: disable=bad-whitespace
-    k = [[ xx + yy + zz,      zy - yz,      xz - zx,      yx - xy,],
-         [      zy - yz, xx - yy - zz,      xy + yx,      xz + zx,],
-         [      xz - zx,      xy + yx, yy - xx - zz,      yz + zy,],
-         [      yx - xy,      xz + zx,      yz + zy, zz - xx - yy,]]
-
-    k = (1./3.) * np.stack([np.stack(x, axis=-1) for x in k],
-                          axis=-2)
-
-    # Get eigenvalues in non-decreasing order and associated.
-    _, qs = np.linalg.eigh(k)
-    return qs[..., -1]
+    [[xx, xy, xz], [yx, yy, yz], [zx, zy, zz]] = [
+        [rot[..., i, j] for j in range(3)] for i in range(3)]
+
+    # Row i of this symmetric matrix is 4 * q_i * q, for a unit quaternion q.
+    k = np.empty(rot.shape[:-2] + (4, 4), dtype=rot.dtype)
+    k[..., 0, 0] = 1 + xx + yy + zz
+    k[..., 1, 1] = 1 + xx - yy - zz
+    k[..., 2, 2] = 1 - xx + yy - zz
+    k[..., 3, 3] = 1 - xx - yy + zz
+    k[..., 0, 1] = k[..., 1, 0] = zy - yz
+    k[..., 0, 2] = k[..., 2, 0] = xz - zx
+    k[..., 0, 3] = k[..., 3, 0] = yx - xy
+    k[..., 1, 2] = k[..., 2, 1] = xy + yx
+    k[..., 1, 3] = k[..., 3, 1] = xz + zx
+    k[..., 2, 3] = k[..., 3, 2] = yz + zy
+
+    # Select the row with the largest diagonal entry and normalize it. For a
+    # rotation this equals dividing by 4 * q_i, but it also keeps the result a
+    # unit quaternion for inputs that are not rotations, such as the all-zero
+    # frames of template residues with missing atoms. The diagonal sums to 4,
+    # so the selected row is never zero.
+    diag = np.diagonal(k, axis1=-2, axis2=-1)
+    idx = np.argmax(diag, axis=-1)[..., None]
+    row = np.take_along_axis(k, idx[..., None], axis=-2)[..., 0, :]
+    row_length2 = np.einsum('...i,...i->...', row, row)
+    return row * (1.0 / np.sqrt(row_length2))[..., None]
 
 
 def quat_to_rot(normalized_quat):
     """Convert a normalized quaternion to a rotation matrix. Quat (..., 4)"""
+    return _quat_to_rot_impl(np, normalized_quat)
 
-    mat = np.expand_dims(normalized_quat, [-1, -3]) # normalized_quat[..., None, :, None]
-    rot_tensor = np.sum(
-        np.reshape(QUAT_TO_ROT, (4, 4, 9)) *
-        normalized_quat[..., :, None, None] *
-        mat,
-        axis=(-3, -2)) # (..., 4, 4, 9) -> (..., 9)
-    t_shape = rot_tensor.shape[:-1]
-    t_shape.extend([3, 3])
-    rot = np.reshape(rot_tensor, t_shape)  # Unstack. (..., 3, 3)
-    return rot
-
-def quat_multiply_by_vec(quat, vec):
-    """Multiply a quaternion by a pure-vector quaternion."""
-    mat = np.expand_dims(vec, [-1, -3]) # vec[..., None, :, None]
-    return np.sum(
-        QUAT_MULTIPLY_BY_VEC *
-        quat[..., :, None, None] *
-        mat,
-        axis=(-3, -2))
-
-def apply_rot_to_vec(rot, vec, unstack=False):
-    """Multiply rotation matrix by a vector. vec is a list.
-    Returns: a list of 3 tensors of the points
-    """
-    if unstack:
-        x, y, z = [vec[..., i] for i in range(3)]
-    else:
-        x, y, z = vec
-    return [rot[..., 0, 0] * x + rot[..., 0, 1] * y + rot[..., 0, 2] * z,
-            rot[..., 1, 0] * x + rot[..., 1, 1] * y + rot[..., 1, 2] * z,
-            rot[..., 2, 0] * x + rot[..., 2, 1] * y + rot[..., 2, 2] * z]
-
-
-def apply_rot_to_vec_np(rot, vec, unstack=False):
-    """Multiply rotation matrix by a vector. vec is a list.
-    Returns: a list of 3 tensors of the points
+
+def _quat_to_rot_impl(xnp, normalized_quat):
+    """quat_to_rot written against the array module xnp (numpy or jax.numpy)."""
+    w, x, y, z = [normalized_quat[..., i] for i in range(4)]
+    ww, xx, yy, zz = w * w, x * x, y * y, z * z
+    wx, wy, wz = w * x, w * y, w * z
+    xy, xz, yz = x * y, x * z, y * z
+
+    # pylint: disable=bad-whitespace
+    rot = xnp.stack([ww + xx - yy - zz,   2 * (xy - wz),     2 * (xz + wy),
+                      2 * (xy + wz),   ww - xx + yy - zz,   2 * (yz - wx),
+                      2 * (xz - wy),     2 * (yz + wx),   ww - xx - yy + zz],
+                   axis=-1)
+    return rot.reshape(w.shape + (3, 3))  # (..., 3, 3)
+
+def _quat_mul_pure_vec(quat, vec):
+    """Multiply a quaternion (..., 4) by a pure-vector quaternion (..., 3)."""
+    return _quat_mul_pure_vec_impl(np, quat, vec)
+
+
+def _quat_mul_pure_vec_impl(xnp, quat, vec):
+    """_quat_mul_pure_vec written against the array module xnp."""
+    w, x, y, z = [quat[..., i] for i in range(4)]
+    v_x, v_y, v_z = [vec[..., i] for i in range(3)]
+    return xnp.stack([-x * v_x - y * v_y - z * v_z,
+                      w * v_x + y * v_z - z * v_y,
+                      w * v_y - x * v_z + z * v_x,
+                      w * v_z + x * v_y - y * v_x], axis=-1)
+
+def apply_rot_to_vec(rot, vec):
+    """Multiply rotation matrix (..., 3, 3) by a vector (..., 3).
+    Returns: a (..., 3) tensor of the points
     """
-    if unstack:
-        x, y, z = [vec[..., i] for i in range(3)]
-    else:
-        x, y, z = vec
-    return [rot[0][0] * x + rot[0][1] * y + rot[0][2] * z,
-            rot[1][0] * x + rot[1][1] * y + rot[1][2] * z,
-            rot[2][0] * x + rot[2][1] * y + rot[2][2] * z]
+    # optimize=True lets einsum hand broadcast (N, 1) x (1, N) layouts to BLAS.
+    return np.einsum('...ij,...j->...i', rot, vec, optimize=True)
 
 
 def apply_inverse_rot_to_vec(rot, vec):
-    """Multiply the inverse of a rotation matrix by a vector. vec is a list.
-    Returns: a list of 3 tensors of the points
+    """Multiply the inverse of a rotation matrix (..., 3, 3) by a vector (..., 3).
+    Returns: a (..., 3) tensor of the points
     """
     # Inverse rotation is just transpose
-    x, y, z = vec
-    return  [rot[..., 0, 0] * x + rot[..., 1, 0] * y + rot[..., 2, 0] * z,
-             rot[..., 0, 1] * x + rot[..., 1, 1] * y + rot[..., 2, 1] * z,
-             rot[..., 0, 2] * x + rot[..., 1, 2] * y + rot[..., 2, 2] * z]
+    return np.einsum('...ji,...j->...i', rot, vec, optimize=True)
+
+
+def _broadcast_points_op(ufunc, a, b):
+    """ufunc(a, b) for broadcast (..., 3) arrays, one component at a time.
+
+    Broadcasting (N, 1, 3) against (1, N, 3) in a single ufunc call loops over
+    the length-3 axis innermost, which is several times slower.
+    """
+    out = np.empty(np.broadcast_shapes(np.shape(a), np.shape(b)),
+                   dtype=np.result_type(a, b))
+    for i in range(3):
+        ufunc(a[..., i], b[..., i], out=out[..., i])
+    return out
+
+
+if USE_JAX:
+    _quat_to_rot_jit = jax.jit(functools.partial(_quat_to_rot_impl, jnp))
+    _apply_rot_jit = jax.jit(
+        lambda rot, vec: jnp.einsum('...ij,...j->...i', rot, vec))
+    _apply_inverse_rot_jit = jax.jit(
+        lambda rot, vec: jnp.einsum('...ji,...j->...i', rot, vec))
+
+    @jax.jit
+    def _pre_compose_jit(quaternion, translation, rotation, update):
+        """QuatAffine.pre_compose on jax arrays; returns the new (q, t)."""
+        new_quaternion = quaternion + _quat_mul_pure_vec_impl(
+            jnp, quaternion, update[..., 0:3])
+        new_quaternion = new_quaternion / jnp.linalg.norm(
+            new_quaternion, axis=-1, keepdims=True)
+        new_translation = translation + jnp.einsum(
+            '...ij,...j->...i', rotation, update[..., 3:6])
+        return new_quaternion, new_translation
+
+
+def _is_jax_array(x):
+    # Checked against np.ndarray too, since older jax.numpy.ndarray also
+    # matches plain NumPy arrays.
+    return (USE_JAX and isinstance(x, jnp.ndarray)
+            and not isinstance(x, np.ndarray))
 
 
 class QuatAffine(object):
@@ -170,7 +193,7 @@ class QuatAffine(object):
     def __init__(self,
         quaternion: np.ndarray,
         translation: np.ndarray,
-        rotation=None, normalize=True):
+        rotation=None, normalize=False, dtype=None):
         """Initialize from quaternion and translation.
 
         Args:
@@ -179,8 +202,13 @@ class QuatAffine(object):
             shape (batch, N_res, 4)
         translation: Translation represented as a vector. (batch, N_res, 3)
         rotation: Same rotation as the quaternion, represented as a (batch, N_res, 3, 3)
-            tensor.  If None, rotation will be calculated from the quaternion.
-        normalize: If True, l2 normalize the quaternion on input.
+            tensor.  If None, rotation will be calculated from the quaternion
+            the first time it is accessed.
+        normalize: If True, l2 normalize the quaternion on input. Not needed
+            for quaternions from rot_to_quat, which are unit-norm even for the
+            all-zero frames of template residues with missing atoms.
+        dtype: Storage dtype of the rotation matrix.  If None, the dtype of the
+            given (or computed) rotation is kept.
         """
 
         if quaternion is not None:
@@ -191,37 +219,67 @@ class QuatAffine(object):
             quaternion = quaternion / q_length[..., None]
 
         if rotation is None:
-            rotation = quat_to_rot(quaternion)
+            assert quaternion is not None
+        else:
+            assert rotation.shape[-1] == 3 and rotation.shape[-2] == 3
+            if dtype is not None and rotation.dtype != dtype:
+                rotation = rotation.astype(dtype)
 
         self.quaternion = quaternion
-        self.rotation = rotation
         self.translation = translation
+        self._rotation = rotation
+        self._dtype = dtype
 
-        assert rotation.shape[-1] == 3 and rotation.shape[-2] == 3
         assert translation.shape[-1] == 3
 
+    @property
+    def rotation(self):
+        """Rotation matrix (batch, N_res, 3, 3), computed lazily from the quaternion."""
+        if self._rotation is None:
+            if _is_jax_array(self.quaternion):
+                rotation = _quat_to_rot_jit(self.quaternion)
+            else:
+                rotation = quat_to_rot(self.quaternion)
+            if self._dtype is not None and rotation.dtype != self._dtype:
+                rotation = rotation.astype(self._dtype)
+            self._rotation = rotation
+        return self._rotation
+
+    def _promoted_rotation(self):
+        """Rotation matrix cast to its common dtype with the translation.
+
+        Only copies when the two differ, e.g. for a rotation stored with a
+        lower-precision dtype.
+        """
+        dtype = np.promote_types(self.rotation.dtype, self.translation.dtype)
+        if self.rotation.dtype == dtype:
+            return self.rotation
+        return self.rotation.astype(dtype)
+
     def to_tensor(self):
         return np.concatenate([self.quaternion, self.translation], axis=-1)
 
     def stop_rot_gradient(self):
         """
             stop the gradient of rotations
+
+            NumPy arrays carry no gradients, so this is a shallow copy kept
+            for parity with the Paddle QuatAffine.
         """
-        quat = self.quaternion
-        if not quat is None:
-            quat = quat.detach()
         return QuatAffine(
-            quaternion=quat,
+            quaternion=self.quaternion,
             translation=self.translation,
-            rotation=self.rotation.detach(),
-            normalize=False)
+            rotation=self._rotation,
+            normalize=False,
+            dtype=self._dtype)
 
     def scale_translation(self, position_scale):
         """Return a new quat affine with a different scale for translation."""
 
         return QuatAffine(self.quaternion,
                         position_scale * self.translation,
-                        rotation=self.rotation, normalize=False)
+                        rotation=self._rotation, normalize=False,
+                        dtype=self._dtype)
 
     @classmethod
     def from_tensor(cls, tensor, normalize=False):
@@ -241,25 +299,35 @@ class QuatAffine(object):
         Returns:
         New QuatAffine object.
         """
+        if _is_jax_array(update) or _is_jax_array(self.quaternion):
+            new_quaternion, new_translation = _pre_compose_jit(
+                self.quaternion, self.translation, self._promoted_rotation(),
+                update)
+            return QuatAffine(new_quaternion, new_translation, rotation=None,
+                              dtype=self._dtype)
+
         vector_quaternion_update = update[..., 0:3]
-        trans_update = [update[..., 3], update[..., 4], update[..., 5]]
+        trans_update = update[..., 3:6]
 
         new_quaternion = (self.quaternion +
-                      quat_multiply_by_vec(self.quaternion,
-                                           vector_quaternion_update))
+                      _quat_mul_pure_vec(self.quaternion,
+                                         vector_quaternion_update))
+        # The update is not unit-norm, so renormalize here.
+        q_length2 = np.einsum('...i,...i->...', new_quaternion, new_quaternion)
+        new_quaternion *= (1.0 / np.sqrt(q_length2))[..., None]
 
-        trans_update = apply_rot_to_vec(self.rotation, trans_update)
-        trans_update = np.stack(trans_update, axis=-1)
+        trans_update = apply_rot_to_vec(self._promoted_rotation(), trans_update)
         new_translation = self.translation + trans_update
 
-        return QuatAffine(new_quaternion, new_translation)
+        return QuatAffine(new_quaternion, new_translation, rotation=None,
+                          dtype=self._dtype)
 
     def apply_to_point(self, point, extra_dims=0):
         """Apply affine to a point.
 
         Args:
-        point: List of 3 tensors to apply affine.
-            each with shape [batch_size, num_residues, num_head*num_point_qk]
+        point: Tensor of points to apply affine.
+            shape [batch_size, num_residues, num_head*num_point_qk, 3]
         extra_dims:  Number of dimensions at the end of the transformed_point
             shape that are not present in the rotation and translation.  The most
             common use is rotation N points at once with extra_dims=1 for use in a
@@ -268,22 +336,29 @@ class QuatAffine(object):
         Returns:
         Transformed point after applying affine.
         """
-        rotation = self.rotation # [batch_size, num_residues, 3, 3]
+        if _is_jax_array(point):
+            rotation = self._promoted_rotation()
+            translation = self.translation
+            for _ in range(extra_dims):
+                translation = jnp.expand_dims(translation, axis=-2)
+                rotation = jnp.expand_dims(rotation, axis=-3)
+            return _apply_rot_jit(rotation, point) + translation
+
+        rotation = self._promoted_rotation() # [batch_size, num_residues, 3, 3]
         translation = self.translation # [batch_size, num_residues, 3]
         for _ in range(extra_dims):
             translation = np.expand_dims(translation, axis=-2)
             rotation = np.expand_dims(rotation, axis=-3)
 
         rot_point = apply_rot_to_vec(rotation, point)
-        return [rot_point[0] + translation[..., 0],
-                rot_point[1] + translation[..., 1],
-                rot_point[2] + translation[..., 2]]
+
+        return rot_point + translation
 
     def invert_point(self, transformed_point, extra_dims=0):
         """Apply inverse of transformation to a point.
 
         Args:
-        transformed_point: List of 3 tensors to apply affine
+        transformed_point: Tensor of points (..., 3) to apply affine
         extra_dims:  Number of dimensions at the end of the transformed_point
             shape that are not present in the rotation and translation.  The most
             common use is rotation N points at once with extra_dims=1 for use in a
@@ -292,56 +367,80 @@ class QuatAffine(object):
         Returns:
         Transformed point after applying affine.
         """
-        rotation = self.rotation
+        if _is_jax_array(transformed_point):
+            rotation = self._promoted_rotation()
+            translation = self.translation
+            for _ in range(extra_dims):
+                translation = jnp.expand_dims(translation, axis=-2)
+                rotation = jnp.expand_dims(rotation, axis=-3)
+            return _apply_inverse_rot_jit(
+                rotation, transformed_point - translation)
+
+        rotation = self._promoted_rotation()
         translation = self.translation
         for _ in range(extra_dims):
             translation = np.expand_dims(translation, axis=-2)
-            rotation = np.expand_dims(rotation, axis=-3)
 
-        rot_point = [
-            transformed_point[0] - translation[..., 0],
-            transformed_point[1] - translation[..., 1],
-            transformed_point[2] - translation[..., 2]]
+        rot_point = _broadcast_points_op(
+            np.subtract, transformed_point, translation)
+        if extra_dims == 0:
+            return apply_inverse_rot_to_vec(rotation, rot_point)
 
-        return apply_inverse_rot_to_vec(rotation, rot_point)
+        # With extra dims the inverse rotation is a batched (P, 3) @ (3, 3)
+        # matmul, so only extra_dims - 1 axes need broadcasting.
+        for _ in range(extra_dims - 1):
+            rotation = np.expand_dims(rotation, axis=-3)
+        return np.matmul(rot_point, rotation)
 
 
 ######Paddle Implementation
-def _multiply(a, b):
-    a1 = a[..., 0, 0]
-    a2 = a[..., 0, 1]
-    a3 = a[..., 0, 2]
-    a11 = a[..., 1, 0]
-    a12 = a[..., 1, 1]
-    a13 = a[..., 1, 2]
-    a21 = a[..., 2, 0]
-    a22 = a[..., 2, 1]
-    a23 = a[..., 2, 2]
-    b1 = b[..., 0, 0]
-    b2 = b[..., 1, 0]
-    b3 = b[..., 0, 1]
-    b11 = b[..., 1, 1]
-    b12 = b[..., 2, 0]
-    b13 = b[..., 0, 2]
-    b21 = b[..., 1, 2]
-    b22 = b[..., 2, 1]
-    b23 = b[..., 2, 2]
-    return np.stack([
-        np.stack([
-        a1*b1 + a2*b2 + a3*b12,
-        a1*b3 + a2*b11 + a3*b22,
-        a1*b13 + a2*b21 + a3*b23], axis=-1),
-
-        np.stack([
-        a11*b1 + a12*b2 + a13*b12,
-        a11*b3 + a12*b11 + a13*b22,
-        a11*b13 + a12*b21 + a13*b23], axis=-1),
-
-        np.stack([
-        a21*b1 + a22*b2+ a23*b12,
-        a21*b3 + a22*b11 + a23*b22,
-        a21*b13 + a22*b21 + a23*b23], axis=-1)], 
-        axis=-2)
+def _rsqrt_inplace(x):
+    """Overwrite x with 1 / sqrt(x + 1e-20) and return it."""
+    x += 1e-20
+    np.sqrt(x, out=x)
+    return np.reciprocal(x, out=x)
+
+
+if USE_NUMBA:
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _make_canonical_kernel(n, ca, c, out_trans, out_rot):
+        """Fused make_canonical_transform over flattened (M, 3) coordinates."""
+        for i in numba.prange(n.shape[0]):
+            # Place CA at the origin.
+            t_x, t_y, t_z = -ca[i, 0], -ca[i, 1], -ca[i, 2]
+            n_x, n_y, n_z = n[i, 0] + t_x, n[i, 1] + t_y, n[i, 2] + t_z
+            c_x, c_y, c_z = c[i, 0] + t_x, c[i, 1] + t_y, c[i, 2] + t_z
+
+            # Place C on the x-axis.
+            xy2 = c_x * c_x + c_y * c_y
+            inv_norm = 1.0 / np.sqrt(xy2 + 1e-20)
+            sin_c1 = -c_y * inv_norm
+            cos_c1 = c_x * inv_norm
+            inv_norm = 1.0 / np.sqrt(xy2 + c_z * c_z + 1e-20)
+            sin_c2 = c_z * inv_norm
+            cos_c2 = np.sqrt(xy2) * inv_norm
+
+            # c_rot = c2_rot @ c1_rot.
+            r00, r01, r02 = cos_c2 * cos_c1, -cos_c2 * sin_c1, sin_c2
+            r10, r11, r12 = sin_c1, cos_c1, 0.
+            r20, r21, r22 = -sin_c2 * cos_c1, sin_c2 * sin_c1, cos_c2
+
+            # Place N in the x-y plane.
+            rn_y = r10 * n_x + r11 * n_y
+            rn_z = r20 * n_x + r21 * n_y + r22 * n_z
+            inv_norm = 1.0 / np.sqrt(rn_y * rn_y + rn_z * rn_z + 1e-20)
+            sin_n = -rn_z * inv_norm
+            cos_n = rn_y * inv_norm
+
+            # rotation = n_rot @ c_rot.
+            out_trans[i, 0], out_trans[i, 1], out_trans[i, 2] = t_x, t_y, t_z
+            out_rot[i, 0, 0], out_rot[i, 0, 1], out_rot[i, 0, 2] = r00, r01, r02
+            out_rot[i, 1, 0] = cos_n * r10 - sin_n * r20
+            out_rot[i, 1, 1] = cos_n * r11 - sin_n * r21
+            out_rot[i, 1, 2] = cos_n * r12 - sin_n * r22
+            out_rot[i, 2, 0] = sin_n * r10 + cos_n * r20
+            out_rot[i, 2, 1] = sin_n * r11 + cos_n * r21
+            out_rot[i, 2, 2] = sin_n * r12 + cos_n * r22
 
 
 def make_canonical_transform(
@@ -373,52 +472,98 @@ def make_canonical_transform(
     assert n_xyz.shape[-1] == 3, n_xyz.shape
     assert n_xyz.shape == ca_xyz.shape == c_xyz.shape, (
       n_xyz.shape, ca_xyz.shape, c_xyz.shape)
-    
+
+    # Promote to a float type once, e.g. for integer coordinates, and use it
+    # for all backends.
+    dtype = np.result_type(n_xyz, ca_xyz, c_xyz, np.float32)
+    n_xyz, ca_xyz, c_xyz = [
+        np.asarray(x, dtype=dtype) for x in (n_xyz, ca_xyz, c_xyz)]
+    # Prefer the compiled kernel, then numba, then the NumPy code below.
+    use_ext = (_canonical_transform is not None
+               and dtype in (np.float32, np.float64))
+    if use_ext or USE_NUMBA:
+        if use_ext:
+            kernel = _canonical_transform.make_canonical_kernel
+        else:
+            kernel = _make_canonical_kernel
+        translation = np.empty(n_xyz.shape, dtype=dtype)
+        rotation = np.empty(n_xyz.shape + (3,), dtype=dtype)
+        kernel(
+            np.ascontiguousarray(n_xyz).reshape(-1, 3),
+            np.ascontiguousarray(ca_xyz).reshape(-1, 3),
+            np.ascontiguousarray(c_xyz).reshape(-1, 3),
+            translation.reshape(-1, 3),
+            rotation.reshape(-1, 3, 3))
+        return (translation, rotation)
+
     # Place CA at the origin.
     translation = -ca_xyz
     n_xyz = n_xyz + translation
     c_xyz = c_xyz + translation
 
+    # Scratch buffers reused through the ufunc chain below; the rotation is
+    # written entry by entry into its output buffer.
+    tmp = np.empty(n_xyz.shape[:-1], dtype=dtype)
+    inv_norm = np.empty(n_xyz.shape[:-1], dtype=dtype)
+    rotation = np.empty(n_xyz.shape + (3,), dtype=dtype)
+
     # Place C on the x-axis.
     c_x, c_y, c_z = [c_xyz[..., i] for i in range(3)]
     # Rotate by angle c1 in the x-y plane (around the z-axis).
-    norm = np.sqrt(c_x ** 2 + c_y ** 2 + 1e-20)
-    sin_c1 = -c_y / norm
-    cos_c1 = c_x / norm
-    zeros = np.zeros_like(sin_c1)
-    ones = np.ones_like(sin_c1)
-
-    c1_rot_matrix = np.stack([cos_c1, -sin_c1, zeros,
-                                  sin_c1,  cos_c1, zeros,
-                                  zeros,    zeros,  ones], axis=-1)
-    c1_rot_matrix = c1_rot_matrix.reshape(sin_c1.shape + (3,3))
+    xy2 = np.multiply(c_x, c_x)
+    xy2 += np.multiply(c_y, c_y, out=tmp)
+    np.copyto(inv_norm, xy2)
+    _rsqrt_inplace(inv_norm)
+    sin_c1 = np.negative(c_y)
+    sin_c1 *= inv_norm
+    cos_c1 = np.multiply(c_x, inv_norm)
 
     # Rotate by angle c2 in the x-z plane (around the y-axis).
-    # norm = paddle.sqrt(1e-20 + c_x ** 2 + c_y ** 2 + c_z ** 2)
-    norm = np.sqrt(np.sum(c_xyz ** 2, axis=-1)) + 1e-20
-    sin_c2 = c_z / norm
-    cos_c2 = np.sqrt(c_x ** 2 + c_y ** 2) / norm
-    c2_rot_matrix = np.stack([cos_c2,  zeros, sin_c2,
-                                  zeros,    ones,  zeros,
-                                  -sin_c2, zeros, cos_c2], axis=-1)
-    c2_rot_matrix = c2_rot_matrix.reshape(sin_c2.shape + (3,3))
-
-    c_rot_matrix = _multiply(c2_rot_matrix, c1_rot_matrix)
-    n_xyz = np.stack(apply_rot_to_vec(c_rot_matrix, n_xyz, unstack=True), axis=-1)
+    np.multiply(c_z, c_z, out=inv_norm)
+    inv_norm += xy2
+    _rsqrt_inplace(inv_norm)
+    sin_c2 = np.multiply(c_z, inv_norm)
+    cos_c2 = np.sqrt(xy2, out=xy2)
+    cos_c2 *= inv_norm
+
+    # c_rot = c2_rot @ c1_rot, expanded; its (1, 2) entry is zero. Row 0 is
+    # left unchanged by n_rot, so it goes straight into the output.
+    np.multiply(cos_c2, cos_c1, out=rotation[..., 0, 0])
+    np.multiply(cos_c2, sin_c1, out=rotation[..., 0, 1])
+    np.negative(rotation[..., 0, 1], out=rotation[..., 0, 1])
+    rotation[..., 0, 2] = sin_c2
+    r10, r11 = sin_c1, cos_c1
+    r20 = np.multiply(sin_c2, cos_c1)
+    np.negative(r20, out=r20)
+    r21 = np.multiply(sin_c2, sin_c1)
+    r22 = cos_c2
 
     # Place N in the x-y plane.
-    _, n_y, n_z = [n_xyz[..., i] for i in range(3)]
+    n_x, n_y, n_z = [n_xyz[..., i] for i in range(3)]
+    rn_y = np.multiply(r10, n_x)
+    rn_y += np.multiply(r11, n_y, out=tmp)
+    rn_z = np.multiply(r20, n_x)
+    rn_z += np.multiply(r21, n_y, out=tmp)
+    rn_z += np.multiply(r22, n_z, out=tmp)
     # Rotate by angle alpha in the y-z plane (around the x-axis).
-    norm = np.sqrt(n_y**2 + n_z**2 + 1e-20)
-    sin_n = -n_z / norm
-    cos_n = n_y / norm
-    n_rot_matrix = np.stack([ones,  zeros,  zeros,
-                              zeros, cos_n, -sin_n,
-                              zeros, sin_n,  cos_n], axis=-1)
-    n_rot_matrix = n_rot_matrix.reshape(sin_n.shape + (3,3))
-    # pylint: enable=bad-whitespace
-
-    return (translation, _multiply(n_rot_matrix, c_rot_matrix))
+    np.multiply(rn_y, rn_y, out=inv_norm)
+    inv_norm += np.multiply(rn_z, rn_z, out=tmp)
+    _rsqrt_inplace(inv_norm)
+    sin_n = np.negative(rn_z, out=rn_z)
+    sin_n *= inv_norm
+    cos_n = np.multiply(rn_y, inv_norm, out=rn_y)
+
+    # rotation = n_rot @ c_rot, expanded.
+    for j, (r1j, r2j) in enumerate(((r10, r20), (r11, r21))):
+        np.multiply(cos_n, r1j, out=rotation[..., 1, j])
+        rotation[..., 1, j] -= np.multiply(sin_n, r2j, out=tmp)
+        np.multiply(sin_n, r1j, out=rotation[..., 2, j])
+        rotation[..., 2, j] += np.multiply(cos_n, r2j, out=tmp)
+    np.multiply(sin_n, r22, out=rotation[..., 1, 2])
+    np.negative(rotation[..., 1, 2], out=rotation[..., 1, 2])
+    np.multiply(cos_n, r22, out=rotation[..., 2, 2])
+
+    return (translation, rotation)
 
 
 def make_transform_from_reference(
@@ -452,21 +597,6 @@ def make_transform_from_reference(
     return np.transpose(rotation, (0, 1, 3, 2)), -translation
 
 #######Numpy Implementation
-def _multiply_np(a, b):
-    return np.stack([
-        np.array([a[0][0]*b[0][0] + a[0][1]*b[1][0] + a[0][2]*b[2][0],
-                    a[0][0]*b[0][1] + a[0][1]*b[1][1] + a[0][2]*b[2][1],
-                    a[0][0]*b[0][2] + a[0][1]*b[1][2] + a[0][2]*b[2][2]]),
-
-        np.array([a[1][0]*b[0][0] + a[1][1]*b[1][0] + a[1][2]*b[2][0],
-                    a[1][0]*b[0][1] + a[1][1]*b[1][1] + a[1][2]*b[2][1],
-                    a[1][0]*b[0][2] + a[1][1]*b[1][2] + a[1][2]*b[2][2]]),
-
-        np.array([a[2][0]*b[0][0] + a[2][1]*b[1][0] + a[2][2]*b[2][0],
-                    a[2][0]*b[0][1] + a[2][1]*b[1][1] + a[2][2]*b[2][1],
-                    a[2][0]*b[0][2] + a[2][1]*b[1][2] + a[2][2]*b[2][2]])])
-
-
 def make_canonical_transform_np(
     n_xyz: np.ndarray,
     ca_xyz: np.ndarray,
@@ -493,44 +623,6 @@ def make_canonical_transform_np(
         * All atoms will be shifted so that N is in the xy plane.
     """
     assert len(n_xyz.shape) == 2, n_xyz.shape
-    assert n_xyz.shape[-1] == 3, n_xyz.shape
-    assert n_xyz.shape == ca_xyz.shape == c_xyz.shape, (n_xyz.shape, ca_xyz.shape, c_xyz.shape)
-
-    # Place CA at the origin.
-    translation = -ca_xyz
-    n_xyz = n_xyz + translation
-    c_xyz = c_xyz + translation
-
-    # Place C on the x-axis.
-    c_x, c_y, c_z = [c_xyz[:, i] for i in range(3)]
-    # Rotate by angle c1 in the x-y plane (around the z-axis).
-    sin_c1 = -c_y / np.sqrt(1e-20 + c_x**2 + c_y**2)
-    cos_c1 = c_x / np.sqrt(1e-20 + c_x**2 + c_y**2)
-    zeros = np.zeros_like(sin_c1)
-    ones = np.ones_like(sin_c1)
-    # pylint: disable=bad-whitespace
-    c1_rot_matrix = np.stack([np.array([cos_c1, -sin_c1, zeros]),
-                               np.array([sin_c1,  cos_c1, zeros]),
-                               np.array([zeros,    zeros,  ones])])
-
-    # Rotate by angle c2 in the x-z plane (around the y-axis).
-    sin_c2 = c_z / np.sqrt(1e-20 + c_x**2 + c_y**2 + c_z**2)
-    cos_c2 = np.sqrt(c_x**2 + c_y**2) / np.sqrt(
-        1e-20 + c_x**2 + c_y**2 + c_z**2)
-    c2_rot_matrix = np.stack([np.array([cos_c2,  zeros, sin_c2]),
-                              np.array([zeros,    ones,  zeros]),
-                              np.array([-sin_c2, zeros, cos_c2])])
-
-    c_rot_matrix = _multiply_np(c2_rot_matrix, c1_rot_matrix)
-    n_xyz = np.stack(apply_rot_to_vec_np(c_rot_matrix, n_xyz, unstack=True)).T
-
-    # Place N in the x-y plane.
-    _, n_y, n_z = [n_xyz[:, i] for i in range(3)]
-    # Rotate by angle alpha in the y-z plane (around the x-axis).
-    sin_n = -n_z / np.sqrt(1e-20 + n_y**2 + n_z**2)
-    cos_n = n_y / np.sqrt(1e-20 + n_y**2 + n_z**2)
-    n_rot_matrix = np.stack([np.array([ones,  zeros,  zeros]),
-                              np.array([zeros, cos_n, -sin_n]),
-                              np.array([zeros, sin_n,  cos_n])])
-
-    return (translation, np.transpose(_multiply_np(n_rot_matrix, c_rot_matrix), [2, 0, 1]))
+    translation, rotation = make_canonical_transform(
+        n_xyz[None], ca_xyz[None], c_xyz[None])
+    return (translation[0], rotation[0])
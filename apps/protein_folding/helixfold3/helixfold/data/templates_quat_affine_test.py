@@ -0,0 +1,264 @@
+#   Copyright (c) 2024 PaddleHelix Authors. All Rights Reserved.
+#
+# Licensed under Creative Commons Attribution-NonCommercial-ShareAlike 4.0
+# International License (the "License");  you may not use this file  except
+# in compliance with the License. You may obtain a copy of the License at
+#
+#     http://creativecommons.org/licenses/by-nc-sa/4.0/
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for templates_quat_affine."""
+
+import importlib
+import os
+from unittest import mock
+
+from absl.testing import absltest
+from absl.testing import parameterized
+from helixfold.data import templates_quat_affine
+import numpy as np
+
+
+_HALF_TURNS = (
+    np.diag([1., -1., -1.]),
+    np.diag([-1., 1., -1.]),
+    np.diag([-1., -1., 1.]),
+    # 180 degrees about (1, 1, 0) / sqrt(2).
+    np.array([[0., 1., 0.], [1., 0., 0.], [0., 0., -1.]]),
+)
+
+
+def _random_backbone(dtype):
+  """Random N, CA, C coordinates of shape (4, 10, 3)."""
+  rng = np.random.RandomState(0)
+  return [rng.normal(size=(4, 10, 3)).astype(dtype) * 5. for _ in range(3)]
+
+
+def _make_canonical_transform(backend, n_xyz, ca_xyz, c_xyz):
+  """Run make_canonical_transform with only the given backend enabled."""
+  module = templates_quat_affine
+  ext = module._canonical_transform if backend == 'ext' else None
+  with mock.patch.object(module, '_canonical_transform', ext), \
+      mock.patch.object(module, 'USE_NUMBA',
+                        module.USE_NUMBA and backend == 'numba'):
+    return module.make_canonical_transform(n_xyz, ca_xyz, c_xyz)
+
+
+def _random_affine(shape=(2, 6)):
+  """Random unit quaternions and translations with batch shape `shape`."""
+  rng = np.random.RandomState(1)
+  quat = rng.normal(size=shape + (4,))
+  quat /= np.linalg.norm(quat, axis=-1, keepdims=True)
+  return quat, 5. * rng.normal(size=shape + (3,))
+
+
+def _list_apply_to_point(rot, trans, point, extra_dims):
+  """List-of-three reference for QuatAffine.apply_to_point."""
+  for _ in range(extra_dims):
+    rot = np.expand_dims(rot, axis=-3)
+    trans = np.expand_dims(trans, axis=-2)
+  x, y, z = [point[..., i] for i in range(3)]
+  return np.stack([
+      rot[..., i, 0] * x + rot[..., i, 1] * y + rot[..., i, 2] * z
+      + trans[..., i] for i in range(3)], axis=-1)
+
+
+def _list_invert_point(rot, trans, point, extra_dims):
+  """List-of-three reference for QuatAffine.invert_point."""
+  for _ in range(extra_dims):
+    rot = np.expand_dims(rot, axis=-3)
+    trans = np.expand_dims(trans, axis=-2)
+  x, y, z = [point[..., i] - trans[..., i] for i in range(3)]
+  return np.stack([
+      rot[..., 0, i] * x + rot[..., 1, i] * y + rot[..., 2, i] * z
+      for i in range(3)], axis=-1)
+
+
+class QuatAffineTest(parameterized.TestCase):
+  """tbd."""
+
+  @parameterized.parameters(
+      ('ext', np.float32), ('ext', np.float64),
+      ('numba', np.float32), ('numba', np.float64),
+  )
+  def testCanonicalTransformBackendsAgree(self, backend, dtype):
+    """tbd."""
+    if backend == 'ext' and templates_quat_affine._canonical_transform is None:
+      self.skipTest('Cython kernel is not built')
+    if backend == 'numba' and not templates_quat_affine.USE_NUMBA:
+      self.skipTest('numba is not available')
+    inputs = _random_backbone(dtype)
+    translation, rotation = _make_canonical_transform(backend, *inputs)
+    expected_translation, expected_rotation = _make_canonical_transform(
+        'numpy', *inputs)
+    self.assertEqual(translation.dtype, dtype)
+    self.assertEqual(rotation.dtype, dtype)
+    atol = 1e-4 if dtype == np.float32 else 1e-10
+    np.testing.assert_allclose(translation, expected_translation, atol=atol)
+    np.testing.assert_allclose(rotation, expected_rotation, atol=atol)
+
+  def testCanonicalTransformIsOrthonormal(self):
+    """tbd."""
+    _, rotation = _make_canonical_transform(
+        'numpy', *_random_backbone(np.float64))
+    identity = np.broadcast_to(np.eye(3), rotation.shape)
+    np.testing.assert_allclose(
+        rotation @ np.swapaxes(rotation, -1, -2), identity, atol=1e-10)
+    np.testing.assert_allclose(np.linalg.det(rotation), 1., atol=1e-10)
+
+  def testQuatRotRoundTrip(self):
+    """tbd."""
+    rng = np.random.RandomState(0)
+    quat = rng.normal(size=(100, 4))
+    quat /= np.linalg.norm(quat, axis=-1, keepdims=True)
+    rot = templates_quat_affine.quat_to_rot(quat)
+    new_quat = templates_quat_affine.rot_to_quat(rot)
+    # q and -q describe the same rotation.
+    sign = np.sign(np.sum(quat * new_quat, axis=-1, keepdims=True))
+    np.testing.assert_allclose(new_quat * sign, quat, atol=1e-10)
+
+  @parameterized.parameters(*range(len(_HALF_TURNS)))
+  def testRotQuatRoundTripHalfTurn(self, index):
+    """tbd."""
+    rot = _HALF_TURNS[index]
+    quat = templates_quat_affine.rot_to_quat(rot)
+    np.testing.assert_allclose(np.linalg.norm(quat), 1., atol=1e-10)
+    np.testing.assert_allclose(
+        templates_quat_affine.quat_to_rot(quat), rot, atol=1e-10)
+
+  def testRotToQuatDegenerate(self):
+    """tbd."""
+    # Template residues with missing atoms have all-zero coordinates.
+    zeros = np.zeros((1, 2, 3))
+    missing_rot, _ = templates_quat_affine.make_transform_from_reference(
+        zeros, zeros, zeros)
+    rot = np.concatenate([
+        missing_rot[0],
+        np.stack([np.zeros((3, 3)), np.ones((3, 3)), 2. * np.eye(3)])])
+    quat = templates_quat_affine.rot_to_quat(rot)
+    self.assertTrue(np.all(np.isfinite(quat)))
+    np.testing.assert_allclose(
+        np.linalg.norm(quat, axis=-1), 1., atol=1e-10)
+
+  @parameterized.parameters(
+      ((2, 6, 3), 0),
+      # The template layout: every frame against every translation.
+      ((2, 1, 6, 3), 1),
+      ((2, 6, 5, 3), 1),
+      ((2, 6, 4, 5, 3), 2),
+  )
+  def testPointsMatchListReference(self, point_shape, extra_dims):
+    """tbd."""
+    quat, trans = _random_affine()
+    rot = templates_quat_affine.quat_to_rot(quat)
+    point = np.random.RandomState(2).normal(size=point_shape)
+    affine = templates_quat_affine.QuatAffine(quat, trans)
+
+    applied = affine.apply_to_point(point, extra_dims=extra_dims)
+    np.testing.assert_allclose(
+        applied, _list_apply_to_point(rot, trans, point, extra_dims),
+        atol=1e-10)
+    inverted = affine.invert_point(point, extra_dims=extra_dims)
+    np.testing.assert_allclose(
+        inverted, _list_invert_point(rot, trans, point, extra_dims),
+        atol=1e-10)
+    np.testing.assert_allclose(
+        affine.invert_point(applied, extra_dims=extra_dims),
+        np.broadcast_to(point, applied.shape), atol=1e-10)
+
+  def testLazyRotation(self):
+    """tbd."""
+    quat, trans = _random_affine()
+    affine = templates_quat_affine.QuatAffine(quat, trans)
+    self.assertIsNone(affine._rotation)
+    rotation = affine.rotation
+    np.testing.assert_allclose(
+        rotation, templates_quat_affine.quat_to_rot(quat), atol=1e-12)
+    self.assertIs(affine.rotation, rotation)
+
+    # Derived affines reuse the cached rotation instead of recomputing it.
+    self.assertIs(affine.stop_rot_gradient().rotation, rotation)
+    scaled = affine.scale_translation(2.)
+    self.assertIs(scaled.rotation, rotation)
+    np.testing.assert_allclose(scaled.translation, 2. * trans)
+
+  def testPreCompose(self):
+    """tbd."""
+    quat, trans = _random_affine()
+    update = 0.3 * np.random.RandomState(3).normal(size=(2, 6, 6))
+    affine = templates_quat_affine.QuatAffine(quat, trans)
+    composed = affine.pre_compose(update)
+    np.testing.assert_allclose(
+        np.linalg.norm(composed.quaternion, axis=-1), 1., atol=1e-12)
+
+    # The update is the transform with quaternion (1, x, y, z), normalized,
+    # and translation (x', y', z'), applied before the affine itself.
+    update_affine = templates_quat_affine.QuatAffine(
+        np.concatenate([np.ones((2, 6, 1)), update[..., 0:3]], axis=-1),
+        update[..., 3:6], normalize=True)
+    point = np.random.RandomState(4).normal(size=(2, 6, 5, 3))
+    np.testing.assert_allclose(
+        composed.apply_to_point(point, extra_dims=1),
+        affine.apply_to_point(
+            update_affine.apply_to_point(point, extra_dims=1), extra_dims=1),
+        atol=1e-10)
+    np.testing.assert_allclose(
+        composed.rotation, affine.rotation @ update_affine.rotation,
+        atol=1e-12)
+
+
+class QuatAffineJaxTest(absltest.TestCase):
+  """tbd."""
+
+  @classmethod
+  def setUpClass(cls):
+    super().setUpClass()
+    try:
+      import jax.numpy  # pylint: disable=g-import-not-at-top,unused-import
+    except ImportError:
+      raise absltest.SkipTest('jax is not available')
+    with mock.patch.dict(os.environ, {'HELIXFOLD_QUAT_BACKEND': 'jax'}):
+      importlib.reload(templates_quat_affine)
+
+  @classmethod
+  def tearDownClass(cls):
+    importlib.reload(templates_quat_affine)
+    super().tearDownClass()
+
+  def testMatchesNumpy(self):
+    """tbd."""
+    import jax.numpy as jnp  # pylint: disable=g-import-not-at-top
+    rng = np.random.RandomState(0)
+    quat = rng.normal(size=(2, 5, 4)).astype(np.float32)
+    quat /= np.linalg.norm(quat, axis=-1, keepdims=True)
+    trans = rng.normal(size=(2, 5, 3)).astype(np.float32)
+    point = rng.normal(size=(2, 5, 7, 3)).astype(np.float32)
+    update = 0.1 * rng.normal(size=(2, 5, 6)).astype(np.float32)
+
+    affine = templates_quat_affine.QuatAffine(quat, trans)
+    jax_affine = templates_quat_affine.QuatAffine(
+        jnp.asarray(quat), jnp.asarray(trans))
+    composed = affine.pre_compose(update)
+    jax_composed = jax_affine.pre_compose(jnp.asarray(update))
+    results = [
+        (affine.rotation, jax_affine.rotation),
+        (affine.apply_to_point(point, extra_dims=1),
+         jax_affine.apply_to_point(jnp.asarray(point), extra_dims=1)),
+        (affine.invert_point(point, extra_dims=1),
+         jax_affine.invert_point(jnp.asarray(point), extra_dims=1)),
+        (composed.quaternion, jax_composed.quaternion),
+        (composed.translation, jax_composed.translation),
+    ]
+    for expected, actual in results:
+      self.assertIsInstance(actual, jnp.ndarray)
+      self.assertNotIsInstance(actual, np.ndarray)
+      np.testing.assert_allclose(np.asarray(actual), expected, atol=1e-5)
+
+
+if __name__ == '__main__':
+  absltest.main()
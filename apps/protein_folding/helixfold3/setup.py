@@ -0,0 +1,37 @@
+#   Copyright (c) 2024 PaddleHelix Authors. All Rights Reserved.
+#
+# Licensed under Creative Commons Attribution-NonCommercial-ShareAlike 4.0
+# International License (the "License");  you may not use this file  except
+# in compliance with the License. You may obtain a copy of the License at
+#
+#     http://creativecommons.org/licenses/by-nc-sa/4.0/
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Builds the optional compiled kernels of HelixFold3 in place.
+
+Usage: python setup.py build_ext --inplace
+"""
+
+from setuptools import Extension, setup
+from Cython.Build import cythonize
+
+
+extensions = [
+    Extension(
+        'helixfold.data._canonical_transform',
+        sources=['helixfold/data/_canonical_transform.pyx'],
+        extra_compile_args=['-O3', '-ffast-math', '-fopenmp'],
+        extra_link_args=['-fopenmp']),
+]
+
+setup(
+    name='helixfold3-kernels',
+    ext_modules=cythonize(
+        extensions, build_dir='build',
+        compiler_directives={'language_level': 3}),
+)